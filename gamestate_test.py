@@ -1,6 +1,9 @@
 """Unit tests for the monte carlo tree search library."""
 import unittest
-from mcts_tic_tac_toe import GameState, GameSimulator
+import mcts_immutable
+import mcts_mutable
+from mcts_tic_tac_toe import (GameState, MonteCarloTreeSearch, WIN_STATE, apply_move,
+                              has_line, playout, transform)
 
 
 class GameStateTestCase(unittest.TestCase):
@@ -22,22 +25,124 @@ class GameStateTestCase(unittest.TestCase):
             result.append(board.is_won())
         self.assertEqual(result, expected)
 
-class GameSimulatorTestCase(unittest.TestCase):
-    """Tests the GameSimulator board"""
+    def test_key_round_trip(self):
+        """Packs a gamestate in a single int and unpacks it again"""
+        board = GameState({'player': True, 'board': (0b010100010, 0b100000001)})
+        unpacked = GameState.from_key(board.get_key())
+        self.assertEqual((unpacked.player, unpacked.board), (True, (0b010100010, 0b100000001)))
+
+    def test_has_line(self):
+        """Checks the packed win check against every mask for all possible boards"""
+        for board in range(0b1000000000):
+            expected = any(board & state == state for state in WIN_STATE)
+            self.assertEqual(has_line(board), expected, bin(board))
+
+class PlayoutTestCase(unittest.TestCase):
+    """Tests the playout on bare boards"""
     def test_is_won_player_0(self):
         """Sets up a almost terminal state that player 0 has to win"""
-        game = GameSimulator({'player': True, 'board': (0b100001110, 0b011010001)})
-        self.assertEqual(game.play_out(), 0)
+        self.assertEqual(playout(0b100001110, 0b011010001, True), 0)
 
     def test_is_won_player_1(self):
         """Sets up a almost terminal state that player 1 has to win"""
-        game = GameSimulator({'player': False, 'board': (0b011010001, 0b100001110)})
-        self.assertEqual(game.play_out(), 1)
+        self.assertEqual(playout(0b011010001, 0b100001110, False), 1)
 
     def test_is_even(self):
         """Sets up a almost terminal state that results in no win"""
-        game = GameSimulator({'player': True, 'board': (0b011010001, 0b100001110)})
-        self.assertEqual(game.play_out(), None)
+        self.assertEqual(playout(0b011010001, 0b100001110, True), None)
+
+class MonteCarloTreeSearchTestCase(unittest.TestCase):
+    """Tests the search on the array based tree"""
+    def test_finds_winning_move(self):
+        """Plays into a position where the top row can be completed in one move"""
+        mcts = MonteCarloTreeSearch(calculation_time=.05)
+        mcts.first_move = False
+        for move in (0b100000000, 0b000100000, 0b010000000, 0b000010000):
+            mcts.set_root_to_move(move)
+        self.assertEqual(mcts.run(), 0b001000000)
+        self.assertTrue(mcts.is_won(mcts.root))
+
+    def test_chooses_after_one_iteration(self):
+        """A new root that was simulated once still has a move to choose"""
+        mcts = MonteCarloTreeSearch()
+        mcts.set_root_to_move(0b000010000)
+        mcts.simulate(mcts.select())
+        move = mcts.choose_best()
+        self.assertIn(move, (0b100000000, 0b010000000, 0b001000000, 0b000100000,
+                             0b000001000, 0b000000100, 0b000000010, 0b000000001))
+
+    def test_simulates_terminal_node_once(self):
+        """A won node counts the whole batch of playouts as wins for its player"""
+        mcts = MonteCarloTreeSearch(playouts_per_leaf=8)
+        for move in (0b100000000, 0b000100000, 0b010000000, 0b000010000, 0b001000000):
+            mcts.set_root_to_move(move)
+        mcts.simulate(mcts.root)
+        self.assertEqual((mcts.visits[mcts.root], mcts.wins[mcts.root]), (8, 8))
+
+    def test_compacts_on_root_swap(self):
+        """After a move only the subtree of the new root is left in the lists"""
+        mcts = MonteCarloTreeSearch(calculation_time=.02)
+        mcts.first_move = False
+        mcts.run()
+        self.assertEqual(mcts.root, 0)
+        reachable = [mcts.root]
+        for node in reachable:
+            reachable.extend(mcts.children(node))
+        self.assertEqual(len(reachable), len(mcts.visits))
+        self.assertTrue(all(mcts.parent[child] == node for node in reachable
+                            for child in mcts.children(node)))
+
+    def test_folds_symmetric_moves(self):
+        """The empty board only has a corner, an edge and the center as distinct moves"""
+        mcts = MonteCarloTreeSearch()
+        mcts.expand(mcts.root)
+        self.assertEqual(len(mcts.children(mcts.root)), 3)
+
+    def test_keeps_orientation(self):
+        """Plays moves that are folded away in the tree, the answers have to fit the real board"""
+        mcts = MonteCarloTreeSearch(calculation_time=.02)
+        mcts.first_move = False
+        state = apply_move(GameState().get_key(), mcts.run())
+        for _ in range(2):
+            move = next(corner for corner in (0b100000000, 0b001000000, 0b000000100, 0b000000001)
+                        if not (state >> 9 | state) & corner)
+            state = apply_move(state, move)
+            mcts.set_root_to_move(move)
+            answer = mcts.run()
+            self.assertFalse((state >> 9 | state) & answer)
+            state = apply_move(state, answer)
+            self.assertEqual(transform(state, mcts.orientation), mcts.state[mcts.root])
+
+
+class LastMoveTestCase(unittest.TestCase):
+    """Tests a winning move on the last free square of the object based trees"""
+    board = (0b110001100, 0b000110011)
+    move = 0b001000000
+
+    def test_mutable_move_won(self):
+        """The move fills the board, but it is a win and not a draw"""
+        gamestate = mcts_mutable.GameState({'player': True, 'board': self.board})
+        self.assertEqual(gamestate.move(self.move), mcts_mutable.WON)
+
+    def test_mutable_playout_won(self):
+        """A rollout with one free square is won by the player that fills it"""
+        self.assertEqual(mcts_mutable.playout(*self.board, True), False)
+
+    def test_immutable_leaf_node_won(self):
+        """The node made for the move is a won leaf, and not a draw"""
+        gamestate = mcts_immutable.GameState({'player': True, 'board': self.board})
+        node = mcts_immutable.Node(gamestate=gamestate.move(self.move), played_move=self.move)
+        self.assertEqual(node.leaf_node, mcts_immutable.WON)
+
+
+class ImmutableTreeTestCase(unittest.TestCase):
+    """Tests the search on the immutable object tree"""
+    def test_set_root_to_move(self):
+        """A move that is not in the tree yet has to end up on the board of the new root"""
+        mcts = mcts_immutable.MonteCarloTreeSearch()
+        mcts.set_root_to_move(0b000010000)
+        self.assertEqual(mcts.root.gamestate.board, (0b000000000, 0b000010000))
+        self.assertEqual(mcts.root.played_move, 0b000010000)
 
 
 if __name__ == '__main__':
@@ -5,6 +5,10 @@ import math
 import random
 from time import perf_counter
 
+# The search draws from its own generator, with randrange bound once at import
+# so the hot loops skip the random module attribute lookups.
+_RNG = random.Random()
+_randrange = _RNG.randrange
 
 CONVERT_MOVE = {
     '0 0': 0b100000000,
@@ -39,30 +43,23 @@ WIN_STATE = (
     0b100010001,
 )
 
-WIN_STATE_MOVE = {
-    0b100000000: (0b111000000, 0b100100100, 0b100010001),
-    0b010000000: (0b111000000, 0b010010010),
-    0b001000000: (0b111000000, 0b001001001, 0b001010100),
-    0b000100000: (0b000111000, 0b100100100),
-    0b000010000: (0b000111000, 0b010010010, 0b100010001, 0b001010100),
-    0b000001000: (0b000111000, 0b001001001),
-    0b000000100: (0b000000111, 0b100100100, 0b001010100),
-    0b000000010: (0b000000111, 0b010010010),
-    0b000000001: (0b000000111, 0b001001001, 0b100010001)
-}
-
-POSSIBLE_MOVES = (
-    0b100000000,
-    0b010000000,
-    0b001000000,
-    0b000100000,
-    0b000010000,
-    0b000001000,
-    0b000000100,
-    0b000000010,
-    0b000000001,
+# Win states that contain the move, indexed by bit_location.bit_length() - 1.
+# Padded to four masks with 0b111111111, which a single player can never fill.
+WIN_STATE_MOVE = (
+    (0b000000111, 0b001001001, 0b100010001, 0b111111111),
+    (0b000000111, 0b010010010, 0b111111111, 0b111111111),
+    (0b000000111, 0b100100100, 0b001010100, 0b111111111),
+    (0b000111000, 0b001001001, 0b111111111, 0b111111111),
+    (0b000111000, 0b010010010, 0b100010001, 0b001010100),
+    (0b000111000, 0b100100100, 0b111111111, 0b111111111),
+    (0b111000000, 0b001001001, 0b001010100, 0b111111111),
+    (0b111000000, 0b010010010, 0b111111111, 0b111111111),
+    (0b111000000, 0b100100100, 0b100010001, 0b111111111),
 )
 
+# Terminal states, as returned for the last played move.
+PLAYING, WON, DRAW = 0, 1, 2
+
 EXPLORATION_CONST = .8
 
 
@@ -74,6 +71,8 @@ class GameState:
     The player who put down the move in the state is noted with a boolean.
     """
 
+    __slots__ = ('player', 'board')
+
     def __init__(self, state=None) -> None:
         if state is None:
             self.player = False
@@ -89,16 +88,12 @@ class GameState:
         """Gets the current player, for the state"""
         return self.player
 
-    def get_state(self):
-        """Gets the state as a dictionary"""
-        return {'player': self.player, 'board': self.board}
-
     def won(self, bit_location: int) -> bool:
         """Checks if the last move won the game, returns True if won"""
-        for state in WIN_STATE_MOVE[bit_location]:
-            if (self.board[self.player] & state) == state:
-                return True
-        return False
+        state_0, state_1, state_2, state_3 = WIN_STATE_MOVE[bit_location.bit_length() - 1]
+        board = self.board[self.player]
+        return ((board & state_0) == state_0 or (board & state_1) == state_1 or
+                (board & state_2) == state_2 or (board & state_3) == state_3)
 
     def get_available(self) -> int:
         """Finds available bits where none of the players has put a mark."""
@@ -108,64 +103,88 @@ class GameState:
         """Takes the available bits, and converts it to a list of possible moves"""
         available_bits = self.get_available()
         available_moves = []
-        for move in POSSIBLE_MOVES:
-            if move & available_bits == move:
-                available_moves.append(move)
+        while available_bits:
+            move = available_bits & -available_bits
+            available_moves.append(move)
+            available_bits ^= move
         return available_moves
 
-    def terminated(self, played_move: int):
-        """Returns True if the played move led to a terminal state."""
-        return self.won(played_move) or self.get_available() == 0
-
-    def move(self, played_move: int) -> dict:
+    def terminated(self, played_move: int) -> int:
         """
-        Takes the current gamestate and applies the move. Returns true if the new
-        game state is terminal.
+        Returns WON if the played move won the game, DRAW if it filled the board
+        without a win and PLAYING otherwise.
         """
-        if self.player:
-            new_board = (self.board[not self.player] |
-                         played_move, self.board[self.player])
-        else:
-            new_board = (self.board[self.player],
-                         self.board[not self.player] | played_move)
-        return {'player': not self.player, 'board': new_board}
+        if self.won(played_move):
+            return WON
+        if self.get_available() == 0:
+            return DRAW
+        return PLAYING
+
+    @staticmethod
+    def _apply_move(player: bool, board_0: int, board_1: int, played_move: int) -> tuple:
+        """Puts the move on the board of the next player, returns the new player and board"""
+        if player:
+            return False, (board_0 | played_move, board_1)
+        return True, (board_0, board_1 | played_move)
+
+    def move(self, played_move: int) -> GameState:
+        """
+        Takes the current gamestate and applies the move. Returns the new gamestate,
+        without building a state dictionary in between.
+        """
+        new_gamestate = GameState.__new__(GameState)
+        new_gamestate.player, new_gamestate.board = GameState._apply_move(
+            self.player, self.board[0], self.board[1], played_move)
+        return new_gamestate
 
 
 class Node:
     """Monte Carlo Tree search node"""
 
+    __slots__ = ('gamestate', 'leaf_node', 'parent', 'played_move', 'children',
+                 'visits', 'wins', '_possible_moves')
+
     def __init__(self, gamestate=None, parent=None, played_move=None) -> None:
         if gamestate:
             self.gamestate = gamestate
-            self.leaf_node = self.gamestate.terminated(played_move)
+            self.leaf_node = gamestate.terminated(played_move)
         else:
             self.gamestate = GameState()
-            self.leaf_node = False
+            self.leaf_node = PLAYING
         self.parent = parent
         self.played_move = played_move
         self.children = []
         self.visits = 0
         self.wins = 0
-        if self.leaf_node:
-            self.possible_moves = []
-        else:
-            self.possible_moves = self.gamestate.get_available_moves()
+        self._possible_moves = None
 
     def __repr__(self) -> str:
         return f'{self.gamestate} {CONVERT_MOVE[self.played_move]}'
 
-    def __lt__(self, other) -> bool:
-        return self.calc_uct() < other.calc_uct()
-
-    def __eq__(self, other) -> bool:
-        return self.calc_uct() == other.calc_uct()
+    @property
+    def possible_moves(self) -> list:
+        """The moves that are not expanded yet, only looked up on first use"""
+        if self._possible_moves is None:
+            if self.leaf_node:
+                self._possible_moves = []
+            else:
+                self._possible_moves = self.gamestate.get_available_moves()
+        return self._possible_moves
 
     def select(self) -> None:
-        """Finds the best (according to uct) child node recursively untill a leaf is reached"""
-        if self.children and not self.possible_moves:
-            max(self.children).select()
-        else:
-            self.expand()
+        """Walks down to the best (according to uct) child node untill a leaf is reached"""
+        node = self
+        while node.children and not node.possible_moves:
+            log_visits = math.log(node.visits)
+            best_uct = -1.0
+            best_node = None
+            for child_node in node.children:
+                uct = child_node.calc_uct(log_visits)
+                if uct > best_uct:
+                    best_uct = uct
+                    best_node = child_node
+            node = best_node
+        node.expand()
 
     def expand(self) -> None:
         """
@@ -173,14 +192,16 @@ class Node:
         If current node is a leaf, it backpropagates the results up the tree.
         """
         if not self.leaf_node:
-            random_move = self.possible_moves.pop(
-                random.choice(range(len(self.possible_moves))))
-            new_gamestate = GameState(self.gamestate.move(random_move))
+            possible_moves = self.possible_moves
+            index = _randrange(len(possible_moves))
+            possible_moves[index], possible_moves[-1] = possible_moves[-1], possible_moves[index]
+            random_move = possible_moves.pop()
+            new_gamestate = self.gamestate.move(random_move)
             self.children.append(
                 Node(gamestate=new_gamestate, parent=self, played_move=random_move))
             self.children[-1].simulate()
         else:
-            if self.gamestate.get_available():
+            if self.leaf_node == WON:
                 result = self.gamestate.get_player()
             else:
                 result = None
@@ -191,17 +212,15 @@ class Node:
         Takes current gamestate and simulates till terminal position,
         then backpropagates results.
         """
-        sim = GameState(self.gamestate.get_state())
-        terminated = False
+        sim = self.gamestate
+        terminated = self.leaf_node
         while not terminated:
             available_moves = sim.get_available_moves()
-            if not available_moves:
-                break
-            new_move = random.choice(available_moves)
-            sim = GameState(sim.move(new_move))
+            new_move = available_moves[_randrange(len(available_moves))]
+            sim = sim.move(new_move)
             terminated = sim.terminated(new_move)
 
-        if sim.get_available():
+        if terminated == WON:
             result = sim.get_player()
         else:
             result = None
@@ -209,18 +228,22 @@ class Node:
 
     def backprop(self, result: int) -> None:
         """Uses results from simulation and backpropogates these up the tree."""
-        self.visits += 1
-        if result == self.gamestate.get_player():
-            self.wins += 1
-        if self.parent:
-            self.parent.backprop(result)
-
-    def calc_uct(self) -> float:
-        """calculates UCT value from a node."""
+        node = self
+        while node is not None:
+            node.visits += 1
+            if result == node.gamestate.get_player():
+                node.wins += 1
+            node = node.parent
+
+    def calc_uct(self, log_parent_visits: float) -> float:
+        """
+        calculates UCT value from a node. The log of the parent visits is the same for
+        all siblings, so it is calculated once by the caller.
+        """
         if self.visits == 0:
             self.visits = 0.001
         return (self.wins/self.visits) + EXPLORATION_CONST * \
-            math.sqrt(math.log(self.parent.visits)/self.visits)
+            math.sqrt(log_parent_visits/self.visits)
 
     def calc_best(self) -> float:
         """Calculates the best node (exploitation factor)."""
@@ -260,8 +283,7 @@ class MonteCarloTreeSearch:
                 next_node = child
                 break
         if next_node is None:
-            next_node = Node(gamestate=GameState(
-                self.root.gamestate.get_state()), played_move=move)
+            next_node = Node(gamestate=self.root.gamestate.move(move), played_move=move)
         self.swap_root(next_node)
 
     def choose_best(self) -> int:
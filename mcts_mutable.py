@@ -5,6 +5,11 @@ import math
 import random
 from time import perf_counter
 
+# The search draws from its own generator, with randrange and random bound once
+# at import so the hot loops skip the random module attribute lookups.
+_RNG = random.Random()
+_randrange = _RNG.randrange
+_random = _RNG.random
 
 CONVERT_MOVE = {
     '0 0': 0b100000000,
@@ -39,32 +44,74 @@ WIN_STATE = (
     0b100010001,
 )
 
-WIN_STATE_MOVE = {
-    0b100000000: (0b111000000, 0b100100100, 0b100010001),
-    0b010000000: (0b111000000, 0b010010010),
-    0b001000000: (0b111000000, 0b001001001, 0b001010100),
-    0b000100000: (0b000111000, 0b100100100),
-    0b000010000: (0b000111000, 0b010010010, 0b100010001, 0b001010100),
-    0b000001000: (0b000111000, 0b001001001),
-    0b000000100: (0b000000111, 0b100100100, 0b001010100),
-    0b000000010: (0b000000111, 0b010010010),
-    0b000000001: (0b000000111, 0b001001001, 0b100010001)
-}
-
-POSSIBLE_MOVES = (
-    0b100000000,
-    0b010000000,
-    0b001000000,
-    0b000100000,
-    0b000010000,
-    0b000001000,
-    0b000000100,
-    0b000000010,
-    0b000000001,
+# All WIN_STATE masks packed next to each other in 10 bit lanes, so a board can
+# be checked against every mask at once. The spare top bit of each lane is a
+# guard bit that only gets borrowed from when that lane has no missing marks.
+WIN_LANE_SIZE = 10
+WIN_SPREAD = sum(1 << (WIN_LANE_SIZE * lane) for lane in range(len(WIN_STATE)))
+WIN_PACKED = sum(state << (WIN_LANE_SIZE * lane) for lane, state in enumerate(WIN_STATE))
+WIN_GUARD = WIN_SPREAD << (WIN_LANE_SIZE - 1)
+
+# Win states that contain the move, indexed by bit_location.bit_length() - 1.
+# Padded to four masks with 0b111111111, which a single player can never fill.
+WIN_STATE_MOVE = (
+    (0b000000111, 0b001001001, 0b100010001, 0b111111111),
+    (0b000000111, 0b010010010, 0b111111111, 0b111111111),
+    (0b000000111, 0b100100100, 0b001010100, 0b111111111),
+    (0b000111000, 0b001001001, 0b111111111, 0b111111111),
+    (0b000111000, 0b010010010, 0b100010001, 0b001010100),
+    (0b000111000, 0b100100100, 0b111111111, 0b111111111),
+    (0b111000000, 0b001001001, 0b001010100, 0b111111111),
+    (0b111000000, 0b010010010, 0b111111111, 0b111111111),
+    (0b111000000, 0b100100100, 0b100010001, 0b111111111),
 )
 
+# Terminal states, as returned for the last played move.
+PLAYING, WON, DRAW = 0, 1, 2
+
 EXPLORATION_CONST = .8
 
+# The moves that make up every combination of available bits, indexed by the bits.
+AVAILABLE_MOVES = tuple(
+    tuple(1 << bit for bit in range(9) if available_bits >> bit & 1)
+    for available_bits in range(0b1000000000))
+
+# A full gamestate packed in one int as player << 18 | board_0 << 9 | board_1.
+PLAYER_BIT = 1 << 18
+
+
+def has_line(board: int) -> bool:
+    """Checks a single player board against all WIN_STATE masks, returns True if one is filled"""
+    missing = ~(board * WIN_SPREAD) & WIN_PACKED
+    return ((missing | WIN_GUARD) - WIN_SPREAD) & WIN_GUARD != WIN_GUARD
+
+
+def playout(board_0: int, board_1: int, player: bool):
+    """
+    Plays random moves on the two boards till a terminal state, using only local ints.
+    The player is the one who put down the last move, returns the winning player or
+    None on a draw.
+    """
+    if has_line(board_1 if player else board_0):
+        return player
+    while True:
+        available_bits = (board_0 | board_1) ^ 0b111111111
+        if not available_bits:
+            return None
+        moves = AVAILABLE_MOVES[available_bits]
+        move = moves[int(_random() * len(moves))]
+        player = not player
+        if player:
+            board_1 |= move
+            board = board_1
+        else:
+            board_0 |= move
+            board = board_0
+        state_0, state_1, state_2, state_3 = WIN_STATE_MOVE[move.bit_length() - 1]
+        if ((board & state_0) == state_0 or (board & state_1) == state_1 or
+                (board & state_2) == state_2 or (board & state_3) == state_3):
+            return player
+
 
 class GameState:
     """
@@ -74,6 +121,8 @@ class GameState:
     The player who put down the move in the state is noted with a boolean.
     """
 
+    __slots__ = ('player', 'board')
+
     def __init__(self, state=None) -> None:
         if state is None:
             self.player = False
@@ -91,16 +140,31 @@ class GameState:
         """Gets the current player, for the state"""
         return self.player
 
-    def get_state(self):
-        """Gets the state as a dictionary"""
-        return {'player': self.player, 'board': (self.board[0], self.board[1])}
+    @classmethod
+    def from_key(cls, key: int) -> GameState:
+        """Makes a gamestate out of a state that was packed in a single int"""
+        gamestate = cls.__new__(cls)
+        gamestate.player = bool(key & PLAYER_BIT)
+        gamestate.board = [(key >> 9) & 0b111111111, key & 0b111111111]
+        return gamestate
+
+    def copy(self) -> GameState:
+        """Makes a copy of the gamestate, with its own board list"""
+        gamestate = GameState.__new__(GameState)
+        gamestate.player = self.player
+        gamestate.board = self.board[:]
+        return gamestate
+
+    def get_key(self) -> int:
+        """Gets the state packed in a single int, player << 18 | board_0 << 9 | board_1"""
+        return self.player << 18 | self.board[0] << 9 | self.board[1]
 
     def _won(self, bit_location: int) -> bool:
         """Checks if the last move won the game, returns True if won"""
-        for state in WIN_STATE_MOVE[bit_location]:
-            if (self.board[self.player] & state) == state:
-                return True
-        return False
+        state_0, state_1, state_2, state_3 = WIN_STATE_MOVE[bit_location.bit_length() - 1]
+        board = self.board[self.player]
+        return ((board & state_0) == state_0 or (board & state_1) == state_1 or
+                (board & state_2) == state_2 or (board & state_3) == state_3)
 
     def get_available(self) -> int:
         """Finds available bits where none of the players has put a mark."""
@@ -108,58 +172,69 @@ class GameState:
 
     def get_available_moves(self) -> list:
         """Takes the available bits, and converts it to a list of possible moves"""
-        available_bits = self.get_available()
-        available_moves = []
-        for move in POSSIBLE_MOVES:
-            if move & available_bits == move:
-                available_moves.append(move)
-        return available_moves
-
-    def move(self, bit_location: int) -> bool:
+        return list(AVAILABLE_MOVES[self.get_available()])
+
+    def move(self, bit_location: int) -> int:
         """
-        Takes the current gamestate and applies the move. Returns true if the new
-        game state is terminal.
+        Takes the current gamestate and applies the move. Returns WON if the move won
+        the game, DRAW if it filled the board without a win and PLAYING otherwise.
         """
         self.player = not self.player
         self.board[self.player] |= bit_location
-        return self._won(bit_location) or self.get_available() == 0
+        if self._won(bit_location):
+            return WON
+        if self.get_available() == 0:
+            return DRAW
+        return PLAYING
 
 
 class Node:
     """Monte Carlo Tree search node"""
 
+    __slots__ = ('gamestate', 'leaf_node', 'parent', 'played_move', 'children',
+                 'visits', 'wins', '_possible_moves')
+
     def __init__(self, gamestate=None, parent=None, played_move=None) -> None:
         if gamestate:
             self.gamestate = gamestate
             self.leaf_node = self.gamestate.move(played_move)
         else:
             self.gamestate = GameState()
-            self.leaf_node = False
+            self.leaf_node = PLAYING
         self.parent = parent
         self.played_move = played_move
         self.children = []
         self.visits = 0
         self.wins = 0
-        if self.leaf_node:
-            self.possible_moves = []
-        else:
-            self.possible_moves = self.gamestate.get_available_moves()
+        self._possible_moves = None
 
     def __repr__(self) -> str:
         return f'{self.gamestate} {CONVERT_MOVE[self.played_move]}'
 
-    def __lt__(self, other) -> bool:
-        return self.calc_uct() < other.calc_uct()
-
-    def __eq__(self, other) -> bool:
-        return self.calc_uct() == other.calc_uct()
+    @property
+    def possible_moves(self) -> list:
+        """The moves that are not expanded yet, only looked up on first use"""
+        if self._possible_moves is None:
+            if self.leaf_node:
+                self._possible_moves = []
+            else:
+                self._possible_moves = self.gamestate.get_available_moves()
+        return self._possible_moves
 
     def select(self) -> None:
-        """Finds the best (according to uct) child node recursively untill a leaf is reached"""
-        if self.children and not self.possible_moves:
-            max(self.children).select()
-        else:
-            self.expand()
+        """Walks down to the best (according to uct) child node untill a leaf is reached"""
+        node = self
+        while node.children and not node.possible_moves:
+            log_visits = math.log(node.visits)
+            best_uct = -1.0
+            best_node = None
+            for child_node in node.children:
+                uct = child_node.calc_uct(log_visits)
+                if uct > best_uct:
+                    best_uct = uct
+                    best_node = child_node
+            node = best_node
+        node.expand()
 
     def expand(self) -> None:
         """
@@ -167,14 +242,16 @@ class Node:
         If current node is a leaf, it backpropagates the results up the tree.
         """
         if not self.leaf_node:
-            random_move = self.possible_moves.pop(
-                random.choice(range(len(self.possible_moves))))
-            new_gamestate = GameState(self.gamestate.get_state())
+            possible_moves = self.possible_moves
+            index = _randrange(len(possible_moves))
+            possible_moves[index], possible_moves[-1] = possible_moves[-1], possible_moves[index]
+            random_move = possible_moves.pop()
+            new_gamestate = self.gamestate.copy()
             self.children.append(
                 Node(gamestate=new_gamestate, parent=self, played_move=random_move))
             self.children[-1].simulate()
         else:
-            if self.gamestate.get_available():
+            if self.leaf_node == WON:
                 result = self.gamestate.get_player()
             else:
                 result = None
@@ -185,35 +262,27 @@ class Node:
         Takes current gamestate and simulates till terminal position,
         then backpropagates results.
         """
-        sim = GameState(self.gamestate.get_state())
-        terminated = False
-        while not terminated:
-            available_moves = sim.get_available_moves()
-            if not available_moves:
-                break
-            new_move = random.choice(available_moves)
-            terminated = sim.move(new_move)
-
-        if sim.get_available():
-            result = sim.get_player()
-        else:
-            result = None
-        self.backprop(result)
+        board_0, board_1 = self.gamestate.board
+        self.backprop(playout(board_0, board_1, self.gamestate.player))
 
     def backprop(self, result: int) -> None:
         """Uses results from simulation and backpropogates these up the tree."""
-        self.visits += 1
-        if result == self.gamestate.get_player():
-            self.wins += 1
-        if self.parent:
-            self.parent.backprop(result)
-
-    def calc_uct(self) -> float:
-        """calculates UCT value from a node."""
+        node = self
+        while node is not None:
+            node.visits += 1
+            if result == node.gamestate.get_player():
+                node.wins += 1
+            node = node.parent
+
+    def calc_uct(self, log_parent_visits: float) -> float:
+        """
+        calculates UCT value from a node. The log of the parent visits is the same for
+        all siblings, so it is calculated once by the caller.
+        """
         if self.visits == 0:
             self.visits = 0.001
         return (self.wins/self.visits) + EXPLORATION_CONST * \
-            math.sqrt(math.log(self.parent.visits)/self.visits)
+            math.sqrt(log_parent_visits/self.visits)
 
     def calc_best(self) -> float:
         """Calculates the best node (exploitation factor)."""
@@ -253,8 +322,7 @@ class MonteCarloTreeSearch:
                 next_node = child
                 break
         if next_node is None:
-            next_node = Node(gamestate=GameState(
-                self.root.gamestate.get_state()), played_move=move)
+            next_node = Node(gamestate=self.root.gamestate.copy(), played_move=move)
         self.swap_root(next_node)
 
     def choose_best(self) -> int:
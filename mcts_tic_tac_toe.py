@@ -5,6 +5,10 @@ import math
 import random
 from time import perf_counter
 
+# The search draws from its own generator, with random bound once at import
+# so the hot loops skip the random module attribute lookups.
+_RNG = random.Random()
+_random = _RNG.random
 
 CONVERT_MOVE = {
     '0 0': 0b100000000,
@@ -39,241 +43,378 @@ WIN_STATE = (
     0b100010001,
 )
 
-POSSIBLE_MOVES = (
-    0b100000000,
-    0b010000000,
-    0b001000000,
-    0b000100000,
-    0b000010000,
-    0b000001000,
-    0b000000100,
-    0b000000010,
-    0b000000001,
-)
+# All WIN_STATE masks packed next to each other in 10 bit lanes, so a board can
+# be checked against every mask at once. The spare top bit of each lane is a
+# guard bit that only gets borrowed from when that lane has no missing marks.
+WIN_LANE_SIZE = 10
+WIN_SPREAD = sum(1 << (WIN_LANE_SIZE * lane) for lane in range(len(WIN_STATE)))
+WIN_PACKED = sum(state << (WIN_LANE_SIZE * lane) for lane, state in enumerate(WIN_STATE))
+WIN_GUARD = WIN_SPREAD << (WIN_LANE_SIZE - 1)
 
 
-class GameState:
+def has_line(board: int) -> bool:
+    """Checks a single player board against all WIN_STATE masks, returns True if one is filled"""
+    missing = ~(board * WIN_SPREAD) & WIN_PACKED
+    return ((missing | WIN_GUARD) - WIN_SPREAD) & WIN_GUARD != WIN_GUARD
+
+
+# The moves that make up every combination of available bits, indexed by the bits.
+AVAILABLE_MOVES = tuple(
+    tuple(1 << bit for bit in range(9) if available_bits >> bit & 1)
+    for available_bits in range(0b1000000000))
+
+# A full gamestate packed in one int as player << 18 | board_0 << 9 | board_1.
+# The lower 18 bits of a packed state are its index in TERMINAL_STATE.
+PLAYER_BIT = 1 << 18
+BOARDS_MASK = PLAYER_BIT - 1
+
+PLAYING, WON, DRAW = 0, 1, 2
+
+
+def _build_terminal_table() -> bytearray:
     """
-    Tic Tac Toe gamestate, the moves are recorded as two 9 bit values.
-    Where 0b100000000 is equal to position '0 0' (top left corner), and
-    0b000000001 is equal to position '2 2' (bottom right corener).
-    The player who put down the move in the state is noted with a boolean.
+    Records for all 3^9 boards where the players marks do not overlap if the game is
+    still playing, won or a draw. The table is indexed by board_0 << 9 | board_1.
     """
+    table = bytearray(1 << 18)
+    for board_0 in range(0b1000000000):
+        free_bits = board_0 ^ 0b111111111
+        board_1 = free_bits
+        while True:
+            if has_line(board_0) or has_line(board_1):
+                table[board_0 << 9 | board_1] = WON
+            elif board_0 | board_1 == 0b111111111:
+                table[board_0 << 9 | board_1] = DRAW
+            if not board_1:
+                break
+            board_1 = (board_1 - 1) & free_bits
+    return table
 
-    def __init__(self, state=None) -> None:
-        if state is None:
-            self.player = False
-            self.board = (0b000000000, 0b000000000)
-        else:
-            self.player = state['player']
-            self.board = state['board']
 
-    def __repr__(self) -> str:
-        return f'Player: {self.player} State: {bin(self.board[0])}, {bin(self.board[1])}'
+TERMINAL_STATE = _build_terminal_table()
 
-    def get_player(self) -> bool:
-        """Gets the current player, for the state"""
-        return self.player
 
-    def get_state(self):
-        """Gets the state as a dictionary"""
-        return {'player': self.player, 'board': self.board}
+def apply_move(state: int, bit_move: int) -> int:
+    """Puts the move on the board of the next player of a packed state, returns the new state"""
+    state ^= PLAYER_BIT
+    if state & PLAYER_BIT:
+        return state | bit_move
+    return state | bit_move << 9
 
-    def is_won(self) -> bool:
-        """Checks if there is a win in the current gamestate, returns True if won"""
-        for state in WIN_STATE:
-            player_0_won = (self.board[0] & state) == state
-            player_1_won = (self.board[1] & state) == state
-            if player_0_won or player_1_won:
-                return True
-        return False
-
-    def _get_available(self) -> int:
-        """Finds available bits where none of the players has put a mark."""
-        return (self.board[0] | self.board[1]) ^ 0b111111111
-
-    def get_available_moves(self) -> list:
-        """Takes the available bits, and converts it to a list of possible moves"""
-        available_bits = self._get_available()
-        available_moves = []
-        for move in POSSIBLE_MOVES:
-            if move & available_bits == move:
-                available_moves.append(move)
-        return available_moves
-
-    def is_terminated(self) -> bool:
-        """Checks if the game is won or that there is a draw"""
-        return self.is_won() or self._get_available() == 0
-
-    def move(self, bit_move: int) -> dict:
-        """Takes the current gamestate and returns a new state with the move applied"""
-        if self.player:
-            new_board = (self.board[not self.player] |
-                         bit_move, self.board[self.player])
-        else:
-            new_board = (self.board[self.player],
-                         self.board[not self.player] | bit_move)
-        return {'player': not self.player, 'board': new_board}
 
+def _symmetry_table(rotations: int, mirrored: bool) -> tuple:
+    """
+    Maps every board to the same board turned a quarter clockwise the given number
+    of times, and mirrored left to right afterwards if mirrored is True.
+    """
+    squares = []
+    for bit in range(9):
+        x, y = (8 - bit) % 3, (8 - bit) // 3
+        for _ in range(rotations):
+            x, y = 2 - y, x
+        if mirrored:
+            x = 2 - x
+        squares.append(8 - (3 * y + x))
+    return tuple(sum(1 << squares[bit] for bit in range(9) if board >> bit & 1)
+                 for board in range(0b1000000000))
 
-class GameSimulator(GameState):
-    """Gamestate that allows simulation to be run on current board"""
 
-    def __init__(self, state=None) -> None:
-        super().__init__(state)
-        self.player = state['player']
-        self.board = [state['board'][0], state['board'][1]]
+# The 8 symmetries of the board (4 rotations, all of them also mirrored), as tables
+# from a board to the transformed board. The first one is the identity.
+SYMMETRIES = tuple(_symmetry_table(rotations, mirrored)
+                   for mirrored in (False, True) for rotations in range(4))
 
-    def __repr__(self) -> str:
-        return f'Player: {self.player} State: {bin(self.board[0])}, {bin(self.board[1])}'
 
-    def move(self, bit_move: int) -> bool:
-        """Alternative move function where the input move is applied to the gamestate"""
-        self.board[not self.player] |= bit_move
-        self.player = not self.player
-        return self.is_terminated()
-
-    def _simulate_move(self) -> bool:
-        """Plays a random move out of available positions"""
-        move = random.choice(self.get_available_moves())
-        return self.move(move)
-
-    def play_out(self) -> int:
-        """Simulates current board till terminal state"""
-        terminated = self.is_terminated()
-        while not terminated:
-            terminated = self._simulate_move()
-        if self.is_won():
-            result = self.get_player()
-        else:
-            result = None
-        return result
+def _find_symmetry(squares: tuple) -> int:
+    """Finds the index of the symmetry that moves every single square to the given squares"""
+    return next(index for index, symmetry in enumerate(SYMMETRIES)
+                if all(symmetry[1 << bit] == squares[bit] for bit in range(9)))
 
 
-class Node:
-    """Monte Carlo Tree search node"""
+# SYMMETRY_INVERSE[a] undoes symmetry a, SYMMETRY_COMPOSED[a][b] applies b and then a.
+SYMMETRY_INVERSE = tuple(
+    _find_symmetry(tuple(symmetry.index(1 << bit) for bit in range(9)))
+    for symmetry in SYMMETRIES)
+SYMMETRY_COMPOSED = tuple(
+    tuple(_find_symmetry(tuple(after[before[1 << bit]] for bit in range(9)))
+          for before in SYMMETRIES)
+    for after in SYMMETRIES)
 
-    def __init__(self, gamestate=None, parent=None, played_move=None) -> None:
-        if gamestate is None:
-            self.gamestate = GameState()
-            self.is_leaf = False
-        else:
-            self.gamestate = gamestate
-            self.is_leaf = gamestate.is_terminated()
-        self.parent = parent
-        self.children = []
-        self.visits = 0
-        self.wins = 0
-        if self.is_leaf:
-            self.possible_moves = []
+
+def transform(state: int, symmetry: int) -> int:
+    """Applies one of the SYMMETRIES to both boards of a packed state"""
+    table = SYMMETRIES[symmetry]
+    return state & PLAYER_BIT | table[(state >> 9) & 0b111111111] << 9 | table[state & 0b111111111]
+
+
+def playout(board_0: int, board_1: int, player: bool):
+    """
+    Plays random moves on the two boards till a terminal state, using only local ints.
+    The player is the one who put down the last move, returns the winning player or
+    None on a draw.
+    """
+    terminal = TERMINAL_STATE[board_0 << 9 | board_1]
+    while not terminal:
+        available_bits = (board_0 | board_1) ^ 0b111111111
+        moves = AVAILABLE_MOVES[available_bits]
+        move = moves[int(_random() * len(moves))]
+        player = not player
+        if player:
+            board_1 |= move
         else:
-            self.possible_moves = self.gamestate.get_available_moves()
-        self.played_move = played_move
-        self.uct = 0
+            board_0 |= move
+        terminal = TERMINAL_STATE[board_0 << 9 | board_1]
+    return player if terminal == WON else None
 
-    def __repr__(self) -> str:
-        return f'{self.gamestate} {CONVERT_MOVE[self.played_move]}'
 
-    def __lt__(self, other) -> bool:
-        return self.uct < other.uct
+class GameState:
+    """
+    Tic Tac Toe gamestate, the moves are recorded as two 9 bit values.
+    Where 0b100000000 is equal to position '0 0' (top left corner), and
+    0b000000001 is equal to position '2 2' (bottom right corener).
+    The player who put down the move in the state is noted with a boolean.
+    """
 
-    def __eq__(self, other) -> bool:
-        return self.uct == other.uct
+    __slots__ = ('player', 'board')
 
-    def select(self, constant: float) -> None:
-        """Finds the best (according to uct) child node recursively untill a leaf is reached"""
-        if self.children and not self.possible_moves:
-            for child_node in self.children:
-                child_node.calc_uct(constant)
-            max(self.children).select(constant)
+    def __init__(self, state=None) -> None:
+        if state is None:
+            self.player = False
+            self.board = (0b000000000, 0b000000000)
         else:
-            self.expand()
+            self.player = state['player']
+            self.board = state['board']
 
-    def expand(self) -> None:
-        """
-        Takes a node with possible moves, and expands one randomly to a child node.
-        If current node is a leaf, it backpropagates the results up the tree.
-        """
-        if not self.is_leaf:
-            random_move = self.possible_moves.pop(
-                random.choice(range(len(self.possible_moves))))
-            new_gamestate = GameState(self.gamestate.move(random_move))
-            self.children.append(
-                Node(gamestate=new_gamestate, parent=self, played_move=random_move))
-            self.children[-1].simulate()
-        else:
-            if self.gamestate.is_won():
-                result = self.gamestate.get_player()
-            else:
-                result = None
-            self.backprop(result)
+    def __repr__(self) -> str:
+        return f'Player: {self.player} State: {bin(self.board[0])}, {bin(self.board[1])}'
 
-    def simulate(self) -> None:
-        """
-        Takes current gamestate and simulates till terminal position,
-        then backpropagates results.
-        """
-        simulation_game = GameSimulator(self.gamestate.get_state())
-        result = simulation_game.play_out()
-        self.backprop(result)
-
-    def backprop(self, result: int) -> None:
-        """Uses results from simulation and backpropogates these up the tree."""
-        self.visits += 1
-        if result == self.gamestate.get_player():
-            self.wins += 1
-        if self.parent:
-            self.parent.backprop(result)
-
-    def calc_uct(self, constant: float) -> None:
-        """calculates UCT value from a node."""
-        if self.visits == 0:
-            self.visits = 0.001
-        self.uct = (self.wins/self.visits) + constant * \
-            math.sqrt(math.log(self.parent.visits)/self.visits)
+    @classmethod
+    def from_key(cls, key: int) -> GameState:
+        """Makes a gamestate out of a state that was packed in a single int"""
+        gamestate = cls.__new__(cls)
+        gamestate.player = bool(key & PLAYER_BIT)
+        gamestate.board = ((key >> 9) & 0b111111111, key & 0b111111111)
+        return gamestate
+
+    def get_key(self) -> int:
+        """Gets the state packed in a single int, player << 18 | board_0 << 9 | board_1"""
+        return self.player << 18 | self.board[0] << 9 | self.board[1]
+
+    def is_won(self) -> bool:
+        """Checks if there is a win in the current gamestate, returns True if won"""
+        return has_line(self.board[0]) or has_line(self.board[1])
 
 
 class MonteCarloTreeSearch:
     """
-    Basic implementation of Monte Carlo Tree Search
+    Basic implementation of Monte Carlo Tree Search. The tree is stored as a
+    structure of arrays, every node is an index into the lists that hold its
+    statistics and packed gamestate (see PLAYER_BIT). All children of a node are
+    added at once, so they form the contiguous block of nodes child_start[node]
+    untill child_end[node]. On every root swap the kept subtree is compacted, so the
+    lists only hold the nodes that can still be reached. Moves that lead to symmetric
+    positions share one child, the orientation is the symmetry that turns the real
+    board into the tree board.
     """
 
-    def __init__(self, exploration_constant=0.8, calculation_time=.09) -> None:
-        self.root = Node()
+    def __init__(self, exploration_constant=0.8, calculation_time=.09,
+                 playouts_per_leaf=16) -> None:
+        self.visits = []
+        self.wins = []
+        self.parent = []
+        self.child_start = []
+        self.child_end = []
+        self.played_move = []
+        self.state = []
+        self.root = self.add_node(-1, None, GameState().get_key())
         self.constant = exploration_constant
         self.calc_time = calculation_time
+        self.playouts = playouts_per_leaf
         self.first_move = True
         self.iterations = 0
+        self.orientation = 0
+
+    def add_node(self, parent: int, played_move: int, state: int) -> int:
+        """Appends an unexpanded node to the tree, returns the node index."""
+        node = len(self.visits)
+        self.visits.append(0)
+        self.wins.append(0)
+        self.parent.append(parent)
+        self.child_start.append(-1)
+        self.child_end.append(-1)
+        self.played_move.append(played_move)
+        self.state.append(state)
+        return node
+
+    def get_player(self, node: int) -> bool:
+        """Gets the player who put down the last move in the gamestate of the node"""
+        return bool(self.state[node] & PLAYER_BIT)
+
+    def is_won(self, node: int) -> bool:
+        """Checks if there is a win in the gamestate of the node"""
+        return TERMINAL_STATE[self.state[node] & BOARDS_MASK] == WON
+
+    def select(self) -> int:
+        """
+        Walks down from the root to the best (according to uct) child node, untill an
+        unvisited node or a leaf is reached. Visited nodes are expanded on the way down,
+        unvisited children always go first. Returns the reached node.
+        """
+        visits, wins = self.visits, self.wins
+        constant, sqrt = self.constant, math.sqrt
+        node = self.root
+        while visits[node]:
+            start = self.child_start[node]
+            if start == -1:
+                start = self.expand(node)
+            end = self.child_end[node]
+            if start == end:
+                break
+            child_visits = visits[start:end]
+            if 0 in child_visits:
+                node = start + child_visits.index(0)
+                break
+            log_visits = math.log(visits[node])
+            best_uct = -1.0
+            for child in range(start, end):
+                child_visit = visits[child]
+                uct = wins[child] / child_visit + constant * sqrt(log_visits / child_visit)
+                if uct > best_uct:
+                    best_uct = uct
+                    node = child
+        return node
+
+    def expand(self, node: int) -> int:
+        """
+        Adds a child node for every available move of the node, returns the index
+        of the first child. A terminal node gets no children. If the position is
+        symmetric, only the smallest move out of every set of symmetric moves is added.
+        """
+        state = self.state[node]
+        start = len(self.visits)
+        if not TERMINAL_STATE[state & BOARDS_MASK]:
+            stabilizer = [SYMMETRIES[symmetry] for symmetry in range(1, len(SYMMETRIES))
+                          if transform(state, symmetry) == state]
+            available_bits = ((state >> 9 | state) & 0b111111111) ^ 0b111111111
+            while available_bits:
+                move = available_bits & -available_bits
+                available_bits ^= move
+                if all(symmetry[move] >= move for symmetry in stabilizer):
+                    self.add_node(node, move, apply_move(state, move))
+        self.child_start[node] = start
+        self.child_end[node] = len(self.visits)
+        return start
+
+    def simulate(self, node: int) -> None:
+        """
+        Takes the gamestate of a node and simulates a batch of playouts till terminal
+        position, then backpropagates the summed results once. A terminal node always
+        gives the same result, so it is looked up once and counted for the whole batch.
+        """
+        state = self.state[node]
+        board_0, board_1 = (state >> 9) & 0b111111111, state & 0b111111111
+        player = self.get_player(node)
+        results = [0, 0]
+        terminal = TERMINAL_STATE[state & BOARDS_MASK]
+        if terminal:
+            if terminal == WON:
+                results[player] = self.playouts
+            self.backprop(node, results)
+            return
+        for _ in range(self.playouts):
+            result = playout(board_0, board_1, player)
+            if result is not None:
+                results[result] += 1
+        self.backprop(node, results)
+
+    def backprop(self, node: int, results: list) -> None:
+        """
+        Uses the win counts of both players from a batch of simulations and
+        backpropogates these up the tree.
+        """
+        visits, wins, state, parent = self.visits, self.wins, self.state, self.parent
+        playouts = self.playouts
+        while node != -1:
+            visits[node] += playouts
+            wins[node] += results[state[node] >> 18]
+            node = parent[node]
+
+    def children(self, node: int) -> range:
+        """Returns the indices of all the child nodes of a node"""
+        return range(self.child_start[node], self.child_end[node])
+
+    def find_child(self, node: int, move: int) -> tuple:
+        """
+        Finds the child node that was reached with the move, or with a move that is
+        symmetric to it. Returns the child and the symmetry that maps the move onto the
+        move of the child, or None as child if the move is not in the tree.
+        """
+        state = self.state[node]
+        for child in self.children(node):
+            for symmetry, table in enumerate(SYMMETRIES):
+                if table[move] == self.played_move[child] and \
+                        transform(state, symmetry) == state:
+                    return child, symmetry
+        return None, 0
+
+    def swap_root(self, next_node: int) -> None:
+        """
+        Takes a new node, and swaps the root to the next node. The iterations are the
+        visits of the old root divided by the playouts that every iteration adds.
+        """
+        self.iterations = self.visits[self.root] // self.playouts
+        self.compact(next_node)
 
-    def swap_root(self, next_node) -> None:
-        """Takes a new node, and swaps the root to the next node."""
-        self.iterations = self.root.visits
-        self.root = next_node
-        self.root.parent = None
+    def compact(self, root: int) -> None:
+        """
+        Copies the subtree of the node to new lists in breadth first order, so the rest
+        of the old tree is dropped. The node becomes the root at index 0, and the
+        children of every node still form one contiguous block.
+        """
+        child_start, child_end = self.child_start, self.child_end
+        order = [root]
+        parent, starts, ends = [-1], [], []
+        for index, node in enumerate(order):
+            start = child_start[node]
+            if start == -1:
+                starts.append(-1)
+                ends.append(-1)
+            else:
+                starts.append(len(order))
+                order.extend(range(start, child_end[node]))
+                ends.append(len(order))
+                parent.extend([index] * (child_end[node] - start))
+        self.visits = [self.visits[node] for node in order]
+        self.wins = [self.wins[node] for node in order]
+        self.played_move = [self.played_move[node] for node in order]
+        self.state = [self.state[node] for node in order]
+        self.parent, self.child_start, self.child_end = parent, starts, ends
+        self.root = 0
 
     def set_root_to_move(self, move: int) -> None:
         """
-        Takes an input move, and swaps the root Node to the node with this move
-        if it exists in the child nodes. Otherwise it makes a new node with the move,
-        and sets it to root.
+        Takes an input move, and swaps the root node to the node with this move
+        (or a symmetric one) if it exists in the child nodes. Otherwise it makes a new
+        node with the move, and sets it to root.
         """
-        next_node = None
-        for child in self.root.children:
-            if child.played_move == move:
-                next_node = child
-                break
+        move = SYMMETRIES[self.orientation][move]
+        next_node, symmetry = self.find_child(self.root, move)
         if next_node is None:
-            next_state = self.root.gamestate.move(move)
-            next_node = Node(gamestate=GameState(
-                next_state), played_move=move)
+            next_node = self.add_node(-1, move, apply_move(self.state[self.root], move))
+        else:
+            self.orientation = SYMMETRY_COMPOSED[symmetry][self.orientation]
         self.swap_root(next_node)
 
     def choose_best(self) -> int:
-        """Chooses best move from root node, returns the move."""
-        for child in self.root.children:
-            child.calc_uct(0)
-        self.swap_root(max(self.root.children))
-        return self.root.played_move
+        """
+        Chooses best move from root node, returns the move. A root that was only
+        simulated has no children yet, so it is expanded first.
+        """
+        if self.child_start[self.root] == -1:
+            self.expand(self.root)
+        self.swap_root(max(self.children(self.root),
+                           key=lambda child: self.wins[child] / max(self.visits[child], 1)))
+        return SYMMETRIES[SYMMETRY_INVERSE[self.orientation]][self.played_move[self.root]]
 
     def run(self) -> int:
         """
@@ -282,7 +423,7 @@ class MonteCarloTreeSearch:
         """
         start = perf_counter()
         while perf_counter() - start < self.calc_time + .9 * self.first_move:
-            self.root.select(self.constant)
+            self.simulate(self.select())
         self.first_move = False
         return self.choose_best()
 
@@ -313,9 +454,9 @@ class PlayGame:
             user_input = input('Enter Move: ')
             print(f'Computer plays: {self.move(user_input)}')
             print(f'Iterations: {self.mcts.iterations}')
-            if self.mcts.root.gamestate.is_won():
+            if self.mcts.is_won(self.mcts.root):
                 print(
-                    f'Game is won by {self.mcts.root.gamestate.get_player()}')
+                    f'Game is won by {self.mcts.get_player(self.mcts.root)}')
                 break
 
     def play_online(self) -> None: